@@ -3,7 +3,8 @@
 
 For each C file, the script:
 - finds the first contiguous block of `#include` lines
-- tries compiling a temporary copy with each include removed
+- tries compiling temporary copies with includes removed, bisecting ranges
+  of includes or dropping one include at a time
 - marks includes as needed when compilation fails without them
 - optionally rewrites the file so the include block only keeps needed headers
 
@@ -13,28 +14,110 @@ Makefile when possible. You can override both via CLI flags.
 from __future__ import annotations
 
 import argparse
+import dataclasses
+import functools
+import hashlib
+import importlib.metadata
+import itertools
+import json
 import os
 import pathlib
 import re
 import shlex
+import shutil
 import subprocess
 import sys
 import tempfile
-from dataclasses import dataclass
-from typing import Iterable, List, Sequence
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Sequence
 
-INCLUDE_RE = re.compile(r"^\s*#\s*include\s*([<\"])([^>\"]+)[>\"]")
+# Whitespace that does not end a line, as the preprocessor skips it around
+# `#` and `include`.
+LINE_SPACE = b" \t\r\f\v"
+
+
+# Probe copies live in temp files whose names and timestamps change between
+# otherwise identical probes; tell ccache to ignore those.
+CCACHE_SLOPPINESS = "include_file_mtime,include_file_ctime,time_macros,file_macro,pch_defines"
 
 
 @dataclass
 class IncludeLine:
-    idx: int
+    """One `#include` line, located by byte offsets into the source buffer."""
+    start: int
+    end: int
     text: str
     target: str
+    angled: bool = False
+
+    @property
+    def span(self) -> tuple[int, int]:
+        return self.start, self.end
+
+    @property
+    def header(self) -> str:
+        """The header as written, e.g. `<stdio.h>` or `"util.h"`."""
+        return f"<{self.target}>" if self.angled else f'"{self.target}"'
+
+
+@dataclass(frozen=True)
+class Toolchain:
+    """Everything needed to run a probe compile; built once and shared with workers."""
+    compiler: str
+    includes: tuple[str, ...]
+    cflags: tuple[str, ...]
+    verbose: bool = False
+    ccache: str | None = None
+    syntax_only: bool = True
+    pch: str | None = None
+    libclang: bool = False
+    # Probes hand back their error text (for --share-symbols); otherwise the
+    # compiler's output is discarded unread.
+    diagnostics: bool = False
+
+
+@dataclass
+class HeaderSymbols:
+    """Cross-file memo: identifiers whose errors showed a header to be needed.
+
+    When dropping a header made some file fail on identifier `x`, any later
+    file that includes the same header and mentions `x` keeps the header
+    without probing. This can only keep includes, never drop them.
+    """
+    symbols: dict[str, set[str]] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
 
+    def learn(self, header: str, symbols: Iterable[str]) -> None:
+        with self.lock:
+            self.symbols.setdefault(header, set()).update(symbols)
 
+    def proves_needed(self, header: str, used: set[str]) -> bool:
+        with self.lock:
+            return not self.symbols.get(header, set()).isdisjoint(used)
+
+
+@dataclass(frozen=True)
+class SearchOptions:
+    """How determine_needed searches for removable includes."""
+    strategy: str = "bisect"
+    pch: bool = False
+    jobs: int = 1
+    shared: HeaderSymbols | None = None
+
+    @property
+    def mode(self) -> str:
+        """The options that can change a result, for the cache key."""
+        return "+".join([self.strategy, *(["pch"] if self.pch else []), *(["shared"] if self.shared is not None else [])])
+
+
+@functools.lru_cache(maxsize=None)
 def parse_make_vars(makefile: pathlib.Path) -> dict[str, str]:
-    """Return a naive variable map from the Makefile (single-line assignments)."""
+    """Return a naive variable map from the Makefile (single-line assignments).
+
+    The map is cached per path; callers must not modify it.
+    """
     vars: dict[str, str] = {}
     if not makefile.exists():
         return vars
@@ -55,7 +138,7 @@ def parse_make_vars(makefile: pathlib.Path) -> dict[str, str]:
     return {k: expand(v) for k, v in vars.items()}
 
 
-def _normalize_includes(include_tokens: List[str], base_dir: pathlib.Path) -> List[str]:
+def _normalize_includes(include_tokens: Iterable[str], base_dir: pathlib.Path) -> List[str]:
     """Turn raw include tokens into -I-prefixed, absolute include flags."""
     normalized: List[str] = []
     for tok in include_tokens:
@@ -72,140 +155,786 @@ def _normalize_includes(include_tokens: List[str], base_dir: pathlib.Path) -> Li
     return normalized
 
 
-def makefile_flags(makefile: pathlib.Path) -> tuple[List[str], List[str]]:
+@functools.lru_cache(maxsize=None)
+def makefile_flags(makefile: pathlib.Path) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """Return the (includes, cflags) a Makefile asks for, resolved once per path."""
     vars = parse_make_vars(makefile)
     include_tokens = shlex.split(vars.get("INCLUDES", ""))
     base_dir = makefile.parent.resolve()
-    includes = _normalize_includes(include_tokens, base_dir)
-    cflags = shlex.split(vars.get("CFLAGS", ""))
+    includes = tuple(_normalize_includes(include_tokens, base_dir))
+    cflags = tuple(shlex.split(vars.get("CFLAGS", "")))
     return includes, cflags
 
 
-def find_include_block(lines: Sequence[str]) -> tuple[int, int, List[IncludeLine]] | None:
+# Flags that make the compiler write a .d file as a side effect; probes must
+# not leave those next to the user's sources. The last three take an argument,
+# either attached or as the next token.
+DEP_OUTPUT_FLAGS = ("-MD", "-MMD", "-MP")
+DEP_OUTPUT_ARG_FLAGS = ("-MF", "-MT", "-MQ")
+
+
+def strip_dep_flags(flags: Iterable[str]) -> tuple[str, ...]:
+    """Return `flags` without dependency-output options such as `-MMD -MP`."""
+    kept: List[str] = []
+    it = iter(flags)
+    for flag in it:
+        if flag in DEP_OUTPUT_FLAGS or flag.startswith("-Wp,-M"):
+            continue
+        if flag in DEP_OUTPUT_ARG_FLAGS:
+            next(it, None)
+            continue
+        if flag.startswith(DEP_OUTPUT_ARG_FLAGS):
+            continue
+        kept.append(flag)
+    return tuple(kept)
+
+
+def _next_line(data: bytes, pos: int) -> int:
+    """Return the offset just past the line starting at `pos`."""
+    nl = data.find(b"\n", pos)
+    return len(data) if nl < 0 else nl + 1
+
+
+def _include_at(line: bytes) -> tuple[int, int, bool] | None:
+    """Parse `line` (without its newline) as an #include; return (target_start, target_end, angled).
+
+    The line may carry anything after the closing `>`/`"`; the target runs
+    to the first `>` or `"` and must not be empty.
+    """
+    rest = line.lstrip(LINE_SPACE)
+    if rest[:1] != b"#":
+        return None
+    rest = rest[1:].lstrip(LINE_SPACE)
+    if rest[:7] != b"include":
+        return None
+    rest = rest[7:].lstrip(LINE_SPACE)
+    opener = rest[:1]
+    if opener != b"<" and opener != b'"':
+        return None
+    begin = len(line) - len(rest) + 1
+    gt, quote = line.find(b">", begin), line.find(b'"', begin)
+    close = gt if quote < 0 or 0 <= gt < quote else quote
+    if close <= begin:
+        return None
+    return begin, close, opener == b"<"
+
+
+def find_include_block(data: bytes) -> tuple[int, int, List[IncludeLine]] | None:
+    """Return (start, end, includes) of the first include block, as byte offsets.
+
+    The block starts at the first #include line and runs until the first line
+    that is neither an #include nor blank. The first one is found by jumping
+    between occurrences of `include` with bytes.find, so lines without it
+    are never looked at.
+    """
     start = None
-    for i, line in enumerate(lines):
-        if INCLUDE_RE.match(line):
-            start = i
+    pos = 0
+    while start is None:
+        hit = data.find(b"include", pos)
+        if hit < 0:
+            return None
+        line_start = data.rfind(b"\n", 0, hit) + 1
+        eol = data.find(b"\n", hit)
+        if data[line_start:hit].strip(LINE_SPACE) == b"#" and _include_at(data[line_start:len(data) if eol < 0 else eol]) is not None:
+            start = line_start
+        pos = hit + 7
+
+    includes: List[IncludeLine] = []
+    pos = start
+    while pos < len(data):
+        line_end = _next_line(data, pos)
+        eol = line_end - 1 if data.endswith(b"\n", pos, line_end) else line_end
+        line = data[pos:eol]
+        found = _include_at(line)
+        if found is not None:
+            begin, close, angled = found
+            text = data[pos:line_end].decode("utf-8", "replace")
+            includes.append(IncludeLine(start=pos, end=line_end, text=text, target=line[begin:close].decode("utf-8", "replace"), angled=angled))
+        elif line.strip(LINE_SPACE):
             break
-    if start is None:
+        pos = line_end
+    return start, pos, includes
+
+
+def _without(data: bytes, skip: Iterable[tuple[int, int]]) -> List[memoryview]:
+    """Return the segments of `data` left after cutting out the `skip` spans."""
+    view = memoryview(data)
+    segments: List[memoryview] = []
+    pos = 0
+    for s, e in sorted(skip):
+        segments.append(view[pos:s])
+        pos = e
+    segments.append(view[pos:])
+    return segments
+
+
+def find_ccache() -> str | None:
+    """Return the path of ccache (or sccache) if one is installed."""
+    return shutil.which("ccache") or shutil.which("sccache")
+
+
+@functools.lru_cache(maxsize=None)
+def supports_syntax_only(compiler: str) -> bool:
+    """Return True if `compiler` accepts -fsyntax-only (gcc and clang do)."""
+    try:
+        proc = subprocess.run([compiler, "-fsyntax-only", "-x", "c", os.devnull], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        return False
+    return proc.returncode == 0
+
+
+@functools.lru_cache(maxsize=None)
+def builtin_include_dir(compiler: str) -> str | None:
+    """Return clang's builtin header dir (stddef.h, stdarg.h, ...), if one can be found.
+
+    Standalone libclang builds often cannot find their builtin headers. gcc's
+    own ones are not parseable by clang, so only a clang is asked: the
+    configured compiler when it is clang, else `clang` from PATH.
+    """
+    candidates = [compiler] if "clang" in compiler_version(compiler) else []
+    if shutil.which("clang"):
+        candidates.append("clang")
+    for cc in candidates:
+        try:
+            out = subprocess.run([cc, "-print-resource-dir"], capture_output=True, text=True).stdout.strip()
+        except OSError:
+            continue
+        include = os.path.join(out, "include")
+        if os.path.isabs(out) and os.path.isdir(include):
+            return include
+    return None
+
+
+# libclang Index objects are not shared between threads, so each thread
+# lazily creates and then reuses its own.
+_CLANG = threading.local()
+
+
+def libclang_check(source: pathlib.Path, tc: Toolchain, contents: bytes | None = None) -> tuple[bool, str]:
+    """Parse `source` in-process with libclang instead of spawning a compiler.
+
+    When `contents` is given it is parsed as an unsaved file, so nothing has
+    to be written to disk. Returns (ok, error diagnostics).
+    """
+    from clang import cindex
+
+    index = getattr(_CLANG, "index", None)
+    if index is None:
+        index = _CLANG.index = cindex.Index.create()
+    args = [*tc.cflags, *tc.includes]
+    builtin = builtin_include_dir(tc.compiler)
+    if builtin:
+        args += ["-isystem", builtin]
+    unsaved = [(str(source), contents.decode("utf-8", "replace"))] if contents is not None else None
+    try:
+        tu = index.parse(str(source), args=args, unsaved_files=unsaved)
+    except cindex.TranslationUnitLoadError:
+        return False, ""
+    errors = [str(d) for d in tu.diagnostics if d.severity >= cindex.Diagnostic.Error]
+    if tc.verbose:
+        print(f"libclang {source} {' '.join(args)}")
+        for diag in tu.diagnostics:
+            print(diag, file=sys.stderr)
+    return not errors, "\n".join(errors)
+
+
+def probe_flags(tc: Toolchain) -> tuple[str, ...]:
+    """Extra flags for probe compiles, which only need a pass/fail answer.
+
+    Stop at the first error unless the user wants the full output. Warnings
+    are left alone: `-w` would also silence -pedantic-errors and
+    `#pragma GCC diagnostic error`, turning failing probes into passing ones.
+    """
+    return () if tc.verbose else ("-Wfatal-errors",)
+
+
+# A located diagnostic ("file:line[:col]: error: ...") versus a global one
+# ("cc1: error: ..."), which cannot be pinned to a single input file.
+LOCATED_ERROR_RE = re.compile(r"^\S.*?:\d+(?::\d+)?: (?:fatal )?error:")
+GLOBAL_ERROR_RE = re.compile(r"^\S[^:]*: (?:fatal )?error:")
+
+
+def compile_batch(sources: Sequence[pathlib.Path], tc: Toolchain) -> List[tuple[bool, str]] | None:
+    """Syntax-check several sources with one compiler driver invocation.
+
+    The driver still runs the frontend once per file but only starts up once.
+    Errors are attributed to inputs by following each diagnostic's location
+    and its "In file included from" chain. Returns (ok, error lines) per
+    source, or None when some error cannot be attributed, so the caller can
+    fall back to one compile each.
+    """
+    cmd = [tc.compiler, "-fsyntax-only", *map(str, sources), *tc.cflags, *probe_flags(tc), *tc.includes]
+    if tc.pch:
+        cmd[1:1] = ["-include", tc.pch]
+    proc = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    if tc.verbose:
+        print(" ".join(cmd))
+        if proc.stderr:
+            print(proc.stderr, file=sys.stderr)
+    if proc.returncode == 0:
+        return [(True, "")] * len(sources)
+
+    names = [f"{src}:" for src in sources]
+    failed: dict[int, List[str]] = {}
+    current: int | None = None
+    for line in proc.stderr.splitlines():
+        mentioned = next((i for i, name in enumerate(names) if name in line), None)
+        if line.startswith("In file included from"):
+            current = mentioned
+        elif mentioned is not None and (not line[:1].isspace() or line.lstrip().startswith("from ")):
+            current = mentioned
+        if LOCATED_ERROR_RE.match(line):
+            if current is None:
+                return None
+            failed.setdefault(current, []).append(line)
+        elif GLOBAL_ERROR_RE.match(line):
+            return None
+    if not failed:
         return None
-    end = start
-    includes: List[IncludeLine] = []
-    while end < len(lines) and (INCLUDE_RE.match(lines[end]) or not lines[end].strip()):
-        m = INCLUDE_RE.match(lines[end])
-        if m:
-            includes.append(IncludeLine(idx=end, text=lines[end], target=m.group(2)))
-        end += 1
-    return start, end, includes
-
-
-def compile_check(source: pathlib.Path, compiler: str, includes: Sequence[str], cflags: Sequence[str], verbose: bool) -> bool:
-    tmp_obj = tempfile.NamedTemporaryFile(delete=False, suffix=".o")
-    tmp_obj.close()
-    cmd = [compiler, "-c", str(source), "-o", tmp_obj.name, *cflags, *includes]
-    proc = subprocess.run(cmd, capture_output=not verbose, text=True)
-    if verbose:
+    return [(i not in failed, "\n".join(failed.get(i, ()))) for i in range(len(sources))]
+
+
+# Identifiers a missing declaration leaves unknown, from gcc ("'foo'
+# undeclared", "implicit declaration of function 'f'") and clang ("use of
+# undeclared identifier 'foo'", "call to undeclared function 'f'"), plus
+# "unknown type name 'bar_t'" from both. Other errors quote any word (local
+# variables, keywords), which would not point at a header. gcc uses
+# typographic quotes in UTF-8 locales.
+ERROR_SYMBOL_RE = re.compile(
+    r"(?:unknown type name |implicit declaration of function |undeclared (?:identifier|function) )[\u2018'`]([A-Za-z_][A-Za-z0-9_]*)[\u2019']"
+    r"|[\u2018'`]([A-Za-z_][A-Za-z0-9_]*)[\u2019'] undeclared"
+)
+IDENT_RE = re.compile(rb"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def error_symbols(errors: str) -> frozenset[str]:
+    """Return the identifiers named by the error lines in compiler output."""
+    return frozenset(
+        m.group(1) or m.group(2)
+        for line in errors.splitlines()
+        if "error" in line
+        for m in ERROR_SYMBOL_RE.finditer(line)
+    )
+
+
+def check_source(source: pathlib.Path, tc: Toolchain, probe: bool = False) -> tuple[bool, str]:
+    """Compile `source`; return (ok, compiler diagnostics).
+
+    Only probes get `probe_flags`; the baseline and --fix compiles run with
+    the user's flags alone.
+    """
+    if tc.libclang:
+        return libclang_check(source, tc)
+    # We only need to know whether the source compiles, so stop after the
+    # frontend when the compiler allows it and never keep an object file.
+    # ccache cannot cache -fsyntax-only runs, and only stores real object
+    # files, so it only wraps the -c fallback, which then writes a throwaway
+    # object next to the source.
+    use_ccache = tc.ccache is not None and not tc.syntax_only
+    if tc.syntax_only:
+        cmd = [tc.compiler, "-fsyntax-only", str(source), *tc.cflags, *tc.includes]
+    else:
+        output = str(source.with_suffix(".o")) if use_ccache else os.devnull
+        cmd = [tc.compiler, "-c", str(source), "-o", output, *tc.cflags, *tc.includes]
+    if probe:
+        cmd[2:2] = probe_flags(tc)
+    if tc.pch:
+        cmd[1:1] = ["-include", tc.pch]
+    env = None
+    if use_ccache:
+        cmd.insert(0, tc.ccache)
+        if tc.pch:
+            cmd.append("-fpch-preprocess")
+        env = {**os.environ, "CCACHE_BASEDIR": str(source.parent), "CCACHE_SLOPPINESS": CCACHE_SLOPPINESS}
+    if not (tc.verbose or tc.diagnostics):
+        # Nothing reads the output, so skip the pipes and the decoding.
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    else:
+        proc = subprocess.run(cmd, capture_output=True, text=True, errors="replace", env=env)
+    if use_ccache:
+        pathlib.Path(output).unlink(missing_ok=True)
+    if proc.stderr is None:
+        return proc.returncode == 0, ""
+    if tc.verbose:
         print(" ".join(cmd))
         if proc.stdout:
             print(proc.stdout)
         if proc.stderr:
             print(proc.stderr, file=sys.stderr)
-    os.unlink(tmp_obj.name)
-    return proc.returncode == 0
+    return proc.returncode == 0, proc.stderr
+
+
+def compile_check(source: pathlib.Path, tc: Toolchain) -> bool:
+    return check_source(source, tc)[0]
+
 
+# Per-worker probe files (fd, path), opened on first use under the run's
+# temp dir and rewritten in place for every probe the worker thread runs.
+# Batched probes need several at once, hence the list. Every fd opened is
+# also recorded in _WORKER_FDS so main can close them once the pool is done.
+_WORKER_DIR: str | None = None
+_WORKER = threading.local()
+_WORKER_FDS: List[int] = []
+_WORKER_IDS = itertools.count()
 
-def write_temp(lines: Sequence[str]) -> pathlib.Path:
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".c", mode="w")
-    tmp.writelines(lines)
+
+def default_tmp_dir() -> str:
+    """Prefer a memory-backed directory for the many short-lived probe files."""
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def _init_worker(tmp_dir: str) -> None:
+    global _WORKER_DIR
+    _WORKER_DIR = tmp_dir
+    _WORKER.probes = []
+    # Numbered rather than named after the thread id, so probe paths (which
+    # ccache hashes) repeat from run to run.
+    _WORKER.index = next(_WORKER_IDS)
+
+
+def _worker_probe(i: int) -> tuple[int, pathlib.Path]:
+    """Return this worker's i-th reusable probe file."""
+    probes: List[tuple[int, pathlib.Path]] = _WORKER.probes
+    while len(probes) <= i:
+        path = pathlib.Path(_WORKER_DIR) / f"probe-{_WORKER.index}-{len(probes)}.c"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        _WORKER_FDS.append(fd)
+        probes.append((fd, path))
+    return probes[i]
+
+
+def _close_worker_probes() -> None:
+    """Close every worker probe file; call after the probe pool has shut down."""
+    global _WORKER_DIR, _WORKER_IDS
+    while _WORKER_FDS:
+        os.close(_WORKER_FDS.pop())
+    _WORKER_DIR = None
+    _WORKER_IDS = itertools.count()
+
+
+def write_temp(segments: Iterable[bytes | memoryview], reuse: tuple[int, pathlib.Path] | None = None) -> pathlib.Path:
+    """Write `segments` to a new temp .c file, or overwrite the `reuse` (fd, path) file."""
+    if reuse is not None:
+        fd, path = reuse
+        os.ftruncate(fd, 0)
+        offset = 0
+        for seg in segments:
+            offset += os.pwrite(fd, seg, offset)
+        return path
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".c")
+    tmp.writelines(segments)
     tmp.close()
     return pathlib.Path(tmp.name)
 
 
-def determine_needed(file_path: pathlib.Path, include_block: List[IncludeLine], lines: Sequence[str], compiler: str, includes: Sequence[str], cflags: Sequence[str], verbose: bool) -> tuple[set[str], bool]:
-    """Return (needed_include_texts, baseline_ok)."""
-    baseline_path = write_temp(lines)
-    baseline_ok = compile_check(baseline_path, compiler, includes, cflags, verbose)
-    os.unlink(baseline_path)
-    if not baseline_ok:
-        return set(), False
+def scan_deps(source: pathlib.Path, tc: Toolchain) -> tuple[set[str], set[str]] | None:
+    """Return (reached, nested) headers of `source`, via one `-M -MG -H` pass.
 
-    needed: set[str] = set()
-    for inc in include_block:
-        trimmed = [ln for i, ln in enumerate(lines) if i != inc.idx]
+    `reached` is every header the preprocessor opens; `nested` those that
+    `-H` shows being opened by another header rather than by `source`
+    itself. Returns None when the compiler cannot produce a dependency list,
+    in which case every include has to be probed.
+    """
+    cmd = [tc.compiler, "-M", "-MG", "-H", str(source), *tc.cflags, *tc.includes]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    # One make rule, "target: source dep ...", wrapped with backslash-newlines
+    # and with spaces in paths escaped.
+    rule = proc.stdout.replace("\\\n", " ")
+    parts = re.split(r"(?<!\\):\s", rule, maxsplit=1)
+    if len(parts) != 2:
+        return None
+    deps = [tok.replace("\\ ", " ") for tok in re.split(r"(?<!\\)\s+", parts[1].strip()) if tok]
+    # -H prints one line per opened header, dotted by depth: ". a.h", ".. b.h".
+    nested = {m.group(1) for m in re.finditer(r"^\.{2,} (.+)$", proc.stderr, re.MULTILINE)}
+    return set(deps[1:]), nested
+
+
+def _dep_matches(target: str, deps: set[str]) -> List[str] | None:
+    """Return the dependency paths an include target can refer to.
+
+    The compiler prints each header as search dir + target, so a plain suffix
+    match is enough. Targets with `.`/`..` components may come out
+    canonicalized, so for those we return None (unknown) instead of guessing.
+    """
+    parts = target.split("/")
+    if "." in parts or ".." in parts:
+        return None
+    return [dep for dep in deps if dep == target or dep.endswith("/" + target)]
+
+
+Spans = frozenset[tuple[int, int]]
+
+
+# Most probes one compiler invocation checks, and so most probe files a worker
+# keeps open.
+MAX_BATCH = 32
+
+# A probe result: whether it compiled, and the identifiers its errors named.
+ProbeResult = tuple[bool, frozenset[str]]
+
+def _probe(data: bytes, skip: Spans, tc: Toolchain) -> ProbeResult:
+    """Compile `data` without the byte spans in `skip`; runs on a probe worker thread."""
+    trimmed = _without(data, skip)
+    if tc.libclang:
+        # Parsed from memory; the name only anchors relative quote includes.
+        ok, errors = libclang_check(pathlib.Path(tempfile.gettempdir()) / "probe.c", tc, b"".join(trimmed))
+    elif _WORKER_DIR is not None:
+        ok, errors = check_source(write_temp(trimmed, reuse=_worker_probe(0)), tc, probe=True)
+    else:
         tmp_path = write_temp(trimmed)
-        ok = compile_check(tmp_path, compiler, includes, cflags, verbose)
+        ok, errors = check_source(tmp_path, tc, probe=True)
         os.unlink(tmp_path)
-        if not ok:
-            needed.add(inc.text)
+    return ok, error_symbols(errors)
+
+
+def _probe_batch(data: bytes, skips: Sequence[Spans], tc: Toolchain) -> List[ProbeResult]:
+    """Run several probes of `data` in one compiler invocation, when possible."""
+    if len(skips) == 1 or not tc.syntax_only or tc.libclang or _WORKER_DIR is None:
+        return [_probe(data, skip, tc) for skip in skips]
+    sources = [write_temp(_without(data, skip), reuse=_worker_probe(i)) for i, skip in enumerate(skips)]
+    results = compile_batch(sources, tc)
+    if results is None:
+        results = [check_source(src, tc, probe=True) for src in sources]
+    return [(ok, error_symbols(errors)) for ok, errors in results]
+
+
+@functools.lru_cache(maxsize=None)
+def compiler_version(compiler: str) -> str:
+    try:
+        return subprocess.run([compiler, "--version"], capture_output=True, text=True).stdout
+    except OSError:
+        return ""
+
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    """Hash a header; the stat fields are only part of the memo key."""
+    with open(path, "rb") as fh:
+        return hashlib.blake2b(fh.read(), digest_size=16).hexdigest()
+
+
+def header_digests(deps: set[str]) -> dict[str, str]:
+    digests: dict[str, str] = {}
+    for dep in sorted(deps):
+        try:
+            st = os.stat(dep)
+        except OSError:
+            digests[dep] = "missing"
+            continue
+        digests[dep] = _file_digest(dep, st.st_mtime_ns, st.st_size)
+    return digests
+
+
+@functools.lru_cache(maxsize=None)
+def libclang_version() -> str:
+    try:
+        return "libclang " + importlib.metadata.version("libclang")
+    except importlib.metadata.PackageNotFoundError:
+        return "libclang"
+
+
+def cache_key(data: bytes, headers: dict[str, str], tc: Toolchain, mode: str) -> str:
+    """Fingerprint everything a result depends on: source, headers, flags, checker and search `mode`."""
+    h = hashlib.blake2b(data, digest_size=20)
+    checker = libclang_version() if tc.libclang else compiler_version(tc.compiler)
+    for part in (json.dumps(headers, sort_keys=True), " ".join((*tc.cflags, *tc.includes)), checker, str(tc.syntax_only), mode):
+        h.update(b"\0")
+        h.update(part.encode("utf-8", "surrogateescape"))
+    return h.hexdigest()
+
+
+def load_cached(cache_dir: pathlib.Path, key: str) -> set[str] | None:
+    try:
+        entry = json.loads((cache_dir / f"{key}.json").read_text())
+        return set(entry["needed"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def store_cached(cache_dir: pathlib.Path, key: str, headers: dict[str, str], tc: Toolchain, needed: set[str]) -> None:
+    entry = {
+        "cflags_hash": hashlib.blake2b(" ".join((*tc.cflags, *tc.includes)).encode(), digest_size=16).hexdigest(),
+        "headers": headers,
+        "needed": sorted(needed),
+    }
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write then rename so concurrent runs never read a partial entry.
+        tmp = tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".tmp", delete=False)
+        with tmp:
+            json.dump(entry, tmp)
+        os.replace(tmp.name, cache_dir / f"{key}.json")
+    except OSError:
+        pass
+
+
+def determine_needed(include_block: List[IncludeLine], data: bytes, tc: Toolchain, executor: Executor, opts: SearchOptions, scan: tuple[set[str], set[str]] | None = None) -> tuple[set[str], bool]:
+    """Return (needed_include_texts, baseline_ok); `scan` is the scan_deps result for `data`."""
+    if not compile_lines([data], tc):
+        return set(), False
+
+    deps, nested = scan if scan is not None else (None, set())
+    # First occurrence of each header -> byte spans to drop when probing it.
+    # Includes the preprocessor never reaches need no probe at all.
+    groups: dict[str, tuple[IncludeLine, frozenset[tuple[int, int]]]] = {}
+    unreached: set[tuple[int, int]] = set()
+    for inc in include_block:
+        key = inc.text.strip()
+        if deps is not None:
+            matches = _dep_matches(inc.target, deps)
+            if matches == []:
+                unreached.add(inc.span)
+                continue
+            if matches and len(matches) == 1:
+                key = os.path.normpath(matches[0])
+        first, skip = groups.get(key, (inc, frozenset()))
+        groups[key] = (first, skip | {inc.span})
+
+    candidates = list(groups.values())
+    # Headers another header already pulls in are the likeliest to go; probed
+    # first, bisection tends to drop them and keep the header pulling them in.
+    searchable = sorted(candidates, key=lambda group: not _dep_matches(group[0].target, nested))
+    learn = None
+    shared = opts.shared
+    if shared is not None:
+        # Keep headers whose removal broke another file on an identifier this
+        # one uses, and record what failing probes here reveal.
+        used = {ident.decode("ascii") for ident in IDENT_RE.findall(data, include_block[-1].end)}
+        searchable = [group for group in searchable if not shared.proves_needed(group[0].header, used)]
+
+        def learn(inc: IncludeLine, symbols: frozenset[str]) -> None:
+            shared.learn(inc.header, symbols)
+
+    removed = frozenset(unreached)
+    removable = _search_all(searchable, removed, data, include_block, tc, executor, opts, learn)
+
+    removable_starts = {inc.start for inc, _ in removable}
+    needed = {inc.text for inc, _ in candidates if inc.start not in removable_starts}
     return needed, True
 
 
-def rebuild_file(lines: List[str], start: int, end: int, include_block: List[IncludeLine], keep_texts: set[str]) -> List[str]:
-    new_block: List[str] = []
+def _search_all(searchable: List[tuple[IncludeLine, Spans]], removed: Spans, data: bytes, include_block: List[IncludeLine], tc: Toolchain, executor: Executor, opts: SearchOptions, learn: Callable[[IncludeLine, frozenset[str]], None] | None) -> List[tuple[IncludeLine, Spans]]:
+    """Search `searchable` for removable includes, in two stages with `opts.pch`."""
+    passed: set[Spans] = set()
+    if not opts.pch:
+        removable = _search_removable(searchable, removed, data, tc, executor, opts, learn, passed)
+    else:
+        # Settle the system headers first, then precompile the ones that stay
+        # and probe the project headers on top of that PCH.
+        system = [group for group in searchable if group[0].angled]
+        project = [group for group in searchable if not group[0].angled]
+        removable = _search_removable(system, removed, data, tc, executor, opts, learn, passed)
+        base = removed.union(*(skip for _, skip in removable))
+        # Per-include probes only showed each system header removable on its
+        # own; the project stage needs a base that compiles as a whole. If it
+        # does not, the project headers are probed without the PCH on top of
+        # the original base.
+        if base != removed and base not in passed and project:
+            if executor.submit(_probe, data, base, tc).result()[0]:
+                passed.add(base)
+            else:
+                base = None
+        pch_path = None
+        if base is not None:
+            removed = base
+            dropped = {inc.start for inc, _ in removable}
+            kept_system = [inc for inc, _ in system if inc.start not in dropped]
+            if project and _pch_is_safe(data, include_block, kept_system):
+                pch_path = precompile_headers([data[inc.start:inc.end] for inc in kept_system], tc)
+        try:
+            project_tc = dataclasses.replace(tc, pch=str(pch_path)) if pch_path else tc
+            removable += _search_removable(project, removed, data, project_tc, executor, opts, learn, passed)
+        finally:
+            if pch_path:
+                shutil.rmtree(pch_path.parent, ignore_errors=True)
+    return removable
+
+
+def _search_removable(candidates: List[tuple[IncludeLine, Spans]], removed: Spans, data: bytes, tc: Toolchain, executor: Executor, opts: SearchOptions, learn: Callable[[IncludeLine, frozenset[str]], None] | None = None, passed: set[Spans] | None = None) -> List[tuple[IncludeLine, Spans]]:
+    """Return the candidates that can be dropped on top of `removed`.
+
+    `learn` is told about each include that failed a probe on its own, along
+    with the identifiers the compiler complained about. The skip set of every
+    probe that compiled is added to `passed`.
+    """
+    if passed is None:
+        passed = set()
+    unresolved = candidates
+    removable: List[tuple[IncludeLine, Spans]] = []
+
+    # Bisect delta-debugging style: drop a whole range at once and only split
+    # it when that fails. After as many probes as candidates, whatever is left
+    # gets independent leave-one-out probes.
+    if opts.strategy == "bisect" and candidates:
+        results: dict[Spans, ProbeResult] = {}
+        unresolved = []
+
+        def compiles(skip: Spans) -> bool:
+            if skip not in results:
+                results[skip] = executor.submit(_probe, data, skip, tc).result()
+                if results[skip][0]:
+                    passed.add(skip)
+            return results[skip][0]
+
+        def find_removable(cands: List[tuple[IncludeLine, Spans]], removed: Spans) -> List[tuple[IncludeLine, Spans]]:
+            if len(results) >= len(candidates):
+                unresolved.extend(cands)
+                return []
+            trial = removed.union(*(skip for _, skip in cands))
+            if compiles(trial):
+                return cands
+            if len(cands) == 1:
+                if learn is not None:
+                    learn(cands[0][0], results[trial][1])
+                return []
+            mid = len(cands) // 2
+            left = find_removable(cands[:mid], removed)
+            removed = removed.union(*(skip for _, skip in left))
+            return left + find_removable(cands[mid:], removed)
+
+        removable = find_removable(candidates, removed)
+        removed = removed.union(*(skip for _, skip in removable))
+
+    # Independent probes: one batch per worker, each checked by a single
+    # compiler invocation. Each slot in a batch holds a probe file open, so
+    # batches are capped at MAX_BATCH.
+    size = min(MAX_BATCH, max(1, -(-len(unresolved) // opts.jobs)))
+    batches = [unresolved[i:i + size] for i in range(0, len(unresolved), size)]
+    futures = {
+        executor.submit(_probe_batch, data, [removed | skip for _, skip in batch], tc): batch
+        for batch in batches
+    }
+    for fut in as_completed(futures):
+        for group, (ok, symbols) in zip(futures[fut], fut.result()):
+            if ok:
+                removable.append(group)
+                passed.add(removed | group[1])
+            elif learn is not None:
+                learn(group[0], symbols)
+    return removable
+
+
+def _pch_is_safe(data: bytes, include_block: List[IncludeLine], kept_system: List[IncludeLine]) -> bool:
+    """True if force-including the kept system headers cannot change meaning.
+
+    The PCH is included before anything else in the file, so that must be
+    where the kept system headers already are: after no project header and no
+    preprocessor directive that could configure them (e.g. _GNU_SOURCE).
+    """
+    first_project = min((inc.start for inc in include_block if not inc.angled), default=len(data))
+    if any(inc.start > first_project for inc in kept_system):
+        return False
+    return not any(ln.lstrip().startswith(b"#") for ln in data[:include_block[0].start].splitlines())
+
+
+def precompile_headers(header_lines: Sequence[bytes], tc: Toolchain) -> pathlib.Path | None:
+    """Build a PCH for `header_lines`; return the header to -include, or None."""
+    if not header_lines:
+        return None
+    pch_dir = pathlib.Path(tempfile.mkdtemp(prefix="pch."))
+    header = pch_dir / "pch.h"
+    header.write_bytes(b"".join(ln if ln.endswith(b"\n") else ln + b"\n" for ln in header_lines))
+    cmd = [tc.compiler, "-x", "c-header", str(header), "-o", f"{header}.gch", *tc.cflags, *tc.includes]
+    quiet = None if tc.verbose else subprocess.DEVNULL
+    proc = subprocess.run(cmd, stdout=quiet, stderr=quiet)
+    if tc.verbose:
+        print(" ".join(cmd))
+    if proc.returncode != 0:
+        shutil.rmtree(pch_dir, ignore_errors=True)
+        return None
+    return header
+
+
+def rebuild_block(data: bytes, end: int, include_block: List[IncludeLine], keep_texts: set[str]) -> bytes:
+    """Return the include block that replaces `data[start:end]`, keeping `keep_texts` once each."""
+    new_block: List[bytes] = []
     seen = set()
+    # Keep the file's line endings when adding newlines of our own.
+    eol = b"\r\n" if data[include_block[0].start:include_block[0].end].endswith(b"\r\n") else b"\n"
     for inc in include_block:
         if inc.text in keep_texts and inc.text not in seen:
             seen.add(inc.text)
-            new_block.append(inc.text if inc.text.endswith("\n") else inc.text + "\n")
-    if new_block and (end >= len(lines) or lines[end].strip()):
-        new_block.append("\n")
-    return lines[:start] + new_block + lines[end:]
+            line = data[inc.start:inc.end]
+            new_block.append(line if line.endswith(b"\n") else line + eol)
+    if new_block and (end >= len(data) or data[end:_next_line(data, end)].strip()):
+        new_block.append(eol)
+    return b"".join(new_block)
 
 
-def compile_lines(lines: Sequence[str], compiler: str, includes: Sequence[str], cflags: Sequence[str], verbose: bool) -> bool:
-    temp_path = write_temp(lines)
-    ok = compile_check(temp_path, compiler, includes, cflags, verbose)
+def compile_lines(segments: Sequence[bytes | memoryview], tc: Toolchain) -> bool:
+    """Compile the source made of `segments`, written out back to back."""
+    temp_path = write_temp(segments)
+    ok = compile_check(temp_path, tc)
     os.unlink(temp_path)
     return ok
 
 
-def process_file(path: pathlib.Path, args, includes: Sequence[str], cflags: Sequence[str]) -> bool:
-    lines = path.read_text().splitlines(keepends=True)
-    block_info = find_include_block(lines)
+def process_file(path: pathlib.Path, args, tc: Toolchain, executor: Executor, opts: SearchOptions) -> tuple[bool, str]:
+    """Check or fix one file; return (ok, report text) for the caller to print."""
+    data = path.read_bytes()
+    block_info = find_include_block(data)
     if not block_info:
-        if args.verbose:
-            print(f"[skip] {path}: no include block found")
-        return True
+        return True, f"[skip] {path}: no include block found" if args.verbose else ""
 
     start, end, include_block = block_info
-    needed, baseline_ok = determine_needed(path, include_block, lines, args.compiler, includes, cflags, args.verbose)
-    if not baseline_ok:
-        print(f"[error] {path}: failed to compile baseline; skipping")
-        return False
+    scan_path = write_temp([data])
+    scan = scan_deps(scan_path, tc)
+    os.unlink(scan_path)
+
+    # Results only depend on the source, the headers it reaches, the flags and
+    # the compiler, so a run over unchanged files can skip every probe.
+    key = headers = None
+    needed = None
+    if args.cache_dir is not None and scan is not None:
+        headers = header_digests(scan[0])
+        # The search options can change which of several redundant includes
+        # goes, so each combination gets its own entries.
+        key = cache_key(data, headers, tc, opts.mode)
+        needed = load_cached(args.cache_dir, key)
+    if needed is None:
+        needed, baseline_ok = determine_needed(include_block, data, tc, executor, opts, scan)
+        if not baseline_ok:
+            return False, f"[error] {path}: failed to compile baseline; skipping"
+        if key is not None:
+            store_cached(args.cache_dir, key, headers, tc, needed)
 
     kept = [inc for inc in include_block if inc.text in needed]
     removed = [inc for inc in include_block if inc.text not in needed]
 
     keep_set = set(inc.text for inc in kept)
 
-    # Second pass: ensure the reduced include block actually compiles. If it
-    # does not, progressively re-add previously removable includes (in order)
+    # Second pass: ensure the reduced include block actually compiles, with
+    # the user's flags and exactly the text that will be written. If it does
+    # not, progressively re-add previously removable includes (in order)
     # until compilation succeeds or nothing is left to add.
     if args.fix:
-        candidate_lines = rebuild_file(lines, start, end, include_block, keep_set)
-        if not compile_lines(candidate_lines, args.compiler, includes, cflags, args.verbose):
+        # Only the block changes between attempts; the text around it is
+        # sliced once and never copied.
+        view = memoryview(data)
+        head, tail = view[:start], view[end:]
+        block = rebuild_block(data, end, include_block, keep_set)
+        if not compile_lines([head, block, tail], tc):
             for inc in removed:
                 keep_set.add(inc.text)
-                candidate_lines = rebuild_file(lines, start, end, include_block, keep_set)
-                if compile_lines(candidate_lines, args.compiler, includes, cflags, args.verbose):
+                block = rebuild_block(data, end, include_block, keep_set)
+                if compile_lines([head, block, tail], tc):
                     break
             else:
-                print(f"[error] {path}: trimmed includes fail to compile; keeping original block")
-                return False
+                return False, f"[error] {path}: trimmed includes fail to compile; keeping original block"
 
-        new_lines = rebuild_file(lines, start, end, include_block, keep_set)
-        if new_lines != lines:
-            path.write_text("".join(new_lines))
-            print(f"[fix] {path}: kept {len(keep_set)}, removed {len(include_block) - len(keep_set)}")
-        else:
-            if args.verbose:
-                print(f"[noop] {path}: no changes needed")
-    else:
-        print(f"[check] {path}: needed {len(kept)}, removable {len(removed)}")
-        if removed:
-            for inc in removed:
-                print(f"    removable: {inc.text.strip()}")
-    return True
+        if block != view[start:end]:
+            with path.open("wb") as out:
+                out.writelines([head, block, tail])
+            return True, f"[fix] {path}: kept {len(keep_set)}, removed {len(include_block) - len(keep_set)}"
+        return True, f"[noop] {path}: no changes needed" if args.verbose else ""
+    report = [f"[check] {path}: needed {len(kept)}, removable {len(removed)}"]
+    report.extend(f"    removable: {inc.text.strip()}" for inc in removed)
+    return True, "\n".join(report)
 
 
 def collect_files(src_dir: pathlib.Path, explicit: Iterable[str] | None) -> List[pathlib.Path]:
@@ -224,20 +953,76 @@ def main(argv: Sequence[str] | None = None) -> int:
     parser.add_argument("--file", action="append", help="Process only these files (relative or absolute paths)")
     parser.add_argument("--fix", action="store_true", help="Rewrite files to keep only needed includes")
     parser.add_argument("--verbose", action="store_true", help="Show compiler output")
+    parser.add_argument("--strategy", choices=("bisect", "each"), default="bisect", help="How to search for removable includes: bisect ranges of includes (default) or probe each include on its own")
+    parser.add_argument("--pch", action="store_true", help="Precompile the kept system headers and reuse them while probing project headers (gcc/clang)")
+    parser.add_argument("--use-libclang", action="store_true", help="Check probes in-process with libclang (clang Python bindings) instead of running the compiler")
+    parser.add_argument("--share-symbols", action="store_true", help="Keep a header without probing when its removal already broke another file on an identifier this file also uses")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="Number of parallel compiler probes (defaults to the CPU count)")
+    parser.add_argument("--tmp-dir", default=None, help="Directory for probe files (defaults to /dev/shm when available)")
+    parser.add_argument("--cache-dir", default=pathlib.Path(".trim_includes_cache"), type=pathlib.Path, help="Where to keep results for unchanged files (defaults to .trim_includes_cache)")
+    parser.add_argument("--no-cache", dest="cache_dir", action="store_const", const=None, help="Do not read or write the result cache")
+    parser.add_argument("--ccache", action="store_true", help="Wrap -c probe compiles in ccache/sccache (only used when the compiler lacks -fsyntax-only)")
     args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.use_libclang:
+        if args.pch:
+            parser.error("--pch cannot be combined with --use-libclang")
+        try:
+            import clang.cindex  # noqa: F401
+        except ImportError:
+            parser.error("--use-libclang needs the clang Python bindings (pip install libclang)")
 
-    mf_includes, mf_cflags = makefile_flags(args.makefile)
+    # Flags are resolved once here and travel to the workers inside the
+    # Toolchain; the Makefile is only read when something is taken from it.
+    # The memo is keyed on the absolute path, so a relative --makefile
+    # (the default) is not mixed up between calls from different cwds.
+    if args.include is None or args.cflag is None:
+        mf_includes, mf_cflags = makefile_flags(args.makefile.resolve())
     includes = args.include if args.include is not None else mf_includes
     cflags = args.cflag if args.cflag is not None else mf_cflags
+    tc = Toolchain(
+        compiler=args.compiler,
+        includes=tuple(includes),
+        cflags=strip_dep_flags(cflags),
+        verbose=args.verbose,
+        ccache=find_ccache() if args.ccache else None,
+        syntax_only=supports_syntax_only(args.compiler),
+        libclang=args.use_libclang,
+        diagnostics=args.share_symbols,
+    )
 
     files = collect_files(args.src_dir, args.file)
     if not files:
         print(f"No .c files found under {args.src_dir}")
         return 1
 
-    ok = True
-    for path in files:
-        ok = process_file(path, args, includes, cflags) and ok
+    # All probe files live in one private directory that is removed at exit,
+    # including each worker's reusable probe file.
+    tmp_dir = tempfile.mkdtemp(prefix="trim_includes.", dir=args.tmp_dir or default_tmp_dir())
+    saved_tempdir, tempfile.tempdir = tempfile.tempdir, tmp_dir
+    try:
+        # Probe workers spend their time waiting on compilers (or in libclang,
+        # which runs without the GIL), so threads keep `jobs` compiles in
+        # flight without pickling every probe to another process. Files only
+        # orchestrate probes and wait on them, so a thread per file is enough
+        # to keep the workers saturated across files. With --share-symbols
+        # what one file learns changes the next one's result, so files run
+        # one at a time in order to keep results (and the cache) repeatable.
+        file_jobs = 1 if args.share_symbols else args.jobs
+        with ThreadPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(tmp_dir,)) as executor, ThreadPoolExecutor(max_workers=file_jobs) as file_pool:
+            opts = SearchOptions(args.strategy, args.pch, args.jobs, HeaderSymbols() if args.share_symbols else None)
+            # Files finish in any order; map() hands the reports back in file
+            # order, so the output does not depend on timing.
+            ok = True
+            for file_ok, report in file_pool.map(lambda path: process_file(path, args, tc, executor, opts), files):
+                if report:
+                    print(report)
+                ok = ok and file_ok
+    finally:
+        _close_worker_probes()
+        tempfile.tempdir = saved_tempdir
+        shutil.rmtree(tmp_dir, ignore_errors=True)
     return 0 if ok else 1
 
 
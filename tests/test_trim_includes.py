@@ -0,0 +1,198 @@
+import dataclasses
+import importlib.util
+import pathlib
+import random
+import re
+import shutil
+import sys
+
+import pytest
+
+SCRIPT = pathlib.Path(__file__).resolve().parent.parent / "script" / "trim_includes.py"
+spec = importlib.util.spec_from_file_location("trim_includes", SCRIPT)
+trim_includes = importlib.util.module_from_spec(spec)
+sys.modules["trim_includes"] = trim_includes
+spec.loader.exec_module(trim_includes)
+
+needs_cc = pytest.mark.skipif(shutil.which("cc") is None, reason="needs a C compiler")
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """A three-file tree: one file with unneeded includes, one clean, one without includes."""
+    (tmp_path / "include").mkdir()
+    (tmp_path / "include" / "util.h").write_text("int util(void);\n")
+    (tmp_path / "Makefile").write_text("INCLUDES = -Iinclude\nCFLAGS = -Wall -Werror=implicit-function-declaration -MMD -MP\n")
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.c").write_text('#include <stdio.h>\n#include <string.h>\n#include "util.h"\n\nint main(void) { return printf("%d", util()); }\n')
+    (src / "b.c").write_text('#include "util.h"\n\nint b(void) { return util(); }\n')
+    (src / "c.c").write_text("int c(void) { return 0; }\n")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@needs_cc
+@pytest.mark.parametrize("extra", [[], ["--strategy", "each"], ["-j1"], ["-j1", "--strategy", "each"], ["--pch"], ["--share-symbols"]])
+def test_check_reports_removable_includes(project, capsys, extra):
+    assert trim_includes.main(["--no-cache", *extra]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out == [
+        "[check] src/a.c: needed 2, removable 1",
+        "    removable: #include <string.h>",
+        "[check] src/b.c: needed 1, removable 0",
+    ]
+    assert not list(project.glob("*.d"))
+
+
+@needs_cc
+def test_fix_rewrites_include_block(project, capsys):
+    assert trim_includes.main(["--no-cache", "--fix"]) == 0
+    assert (project / "src" / "a.c").read_text().startswith('#include <stdio.h>\n#include "util.h"\n\nint main')
+    assert (project / "src" / "b.c").read_text() == '#include "util.h"\n\nint b(void) { return util(); }\n'
+
+
+@needs_cc
+def test_fix_compiles_before_writing(project, capsys, monkeypatch):
+    # Whatever the search concludes, --fix only writes a block it compiled.
+    # Re-adding in order only compiles once "util.h" is back, which restores
+    # the whole block.
+    original = (project / "src" / "a.c").read_text()
+    monkeypatch.setattr(trim_includes, "determine_needed", lambda *args: (set(), True))
+    assert trim_includes.main(["--no-cache", "--fix", "--file", "src/a.c"]) == 0
+    assert capsys.readouterr().out == ""
+    assert (project / "src" / "a.c").read_text() == original
+
+
+@needs_cc
+def test_cached_run_matches(project, capsys):
+    assert trim_includes.main([]) == 0
+    first = capsys.readouterr().out
+    assert trim_includes.main([]) == 0
+    assert capsys.readouterr().out == first
+
+
+@needs_cc
+def test_pedantic_errors_are_not_silenced(project, capsys):
+    (project / "Makefile").write_text("CFLAGS = -std=c11 -pedantic-errors\n")
+    (project / "src" / "b.c").unlink()
+    assert trim_includes.main(["--no-cache", "--file", "src/a.c", "--include=-Iinclude"]) == 0
+    assert "removable: #include <stdio.h>" not in capsys.readouterr().out
+
+
+@needs_cc
+def test_probes_see_rewritten_line_numbers(project, capsys):
+    # Dropping <string.h> would move the assertion to line 4 in the
+    # rewritten file, so the probe must see that shift too.
+    (project / "src" / "b.c").write_text('/* b */\n#include "util.h"\n#include <string.h>\n\n_Static_assert(__LINE__ == 5, "line");\nint b(void) { return util(); }\n')
+    assert trim_includes.main(["--no-cache", "--file", "src/b.c"]) == 0
+    assert capsys.readouterr().out.splitlines() == ["[check] src/b.c: needed 2, removable 0"]
+
+
+
+
+
+@needs_cc
+def test_probes_keep_main_file_warnings(project, capsys):
+    # -Wunused-macros only looks at macros defined in the main file, so
+    # probes must compile the whole file as their main file.
+    (project / "Makefile").write_text("INCLUDES = -Iinclude\nCFLAGS = -Wunused-macros -Werror\n")
+    (project / "include" / "util.h").write_text("int util(int x);\nenum { UTIL = UTIL_ARG };\n")
+    (project / "src" / "a.c").write_text('#define UTIL_ARG 1\n#include "util.h"\nint main(void) { return 0; }\n')
+    assert trim_includes.main(["--no-cache", "--file", "src/a.c", "--fix"]) == 0
+    assert capsys.readouterr().out.splitlines() == ["[fix] src/a.c: kept 1, removed 0"]
+
+
+@needs_cc
+def test_share_symbols_ignores_unrelated_quoted_names(project, capsys):
+    (project / "src" / "a.c").write_text("#include <sys/stat.h>\n\nint a(const char *p) { struct stat st; return stat(p, &st); }\n")
+    (project / "src" / "b.c").write_text("#include <sys/stat.h>\n\nint b(int st) { return st; }\n")
+    (project / "src" / "c.c").unlink()
+    assert trim_includes.main(["--no-cache", "-j1", "--share-symbols"]) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "[check] src/a.c: needed 1, removable 0",
+        "[check] src/b.c: needed 0, removable 1",
+        "    removable: #include <sys/stat.h>",
+    ]
+
+
+@needs_cc
+def test_compile_batch_attributes_errors(tmp_path):
+    (tmp_path / "bad.h").write_text("int broken(void) { return missing; }\n")
+    good = tmp_path / "good.c"
+    good.write_text("int good(void) { return 0; }\n")
+    direct = tmp_path / "direct.c"
+    direct.write_text("int direct(void) { return nope; }\n")
+    nested = tmp_path / "nested.c"
+    nested.write_text('#include "bad.h"\nint nested(void) { return 0; }\n')
+    tc = trim_includes.Toolchain(compiler="cc", includes=(f"-I{tmp_path}",), cflags=(), diagnostics=True)
+    results = trim_includes.compile_batch([good, direct, nested], tc)
+    assert [ok for ok, _ in results] == [True, False, False]
+    assert "nope" in results[1][1] and "missing" in results[2][1]
+    assert trim_includes.error_symbols(results[1][1]) == {"nope"}
+
+
+# The regexes find_include_block replaced; the scanner must agree with them.
+REF_INCLUDE_RE = re.compile(rb"^[^\S\n]*#[^\S\n]*include[^\S\n]*([<\"])([^>\"\n]+)[>\"]", re.MULTILINE)
+REF_BLOCK_RE = re.compile(rb"(?:[^\S\n]*(?:#[^\S\n]*include[^\S\n]*[<\"][^>\"\n]+[>\"][^\n]*)?(?:\n|\Z))+")
+
+
+def reference_include_block(data):
+    first = REF_INCLUDE_RE.search(data)
+    if first is None:
+        return None
+    start = first.start()
+    end = REF_BLOCK_RE.match(data, start).end()
+    includes = []
+    for m in REF_INCLUDE_RE.finditer(data, start, end):
+        nl = data.find(b"\n", m.start())
+        line_end = len(data) if nl < 0 else nl + 1
+        text = data[m.start():line_end].decode("utf-8", "replace")
+        includes.append((m.start(), line_end, text, m.group(2).decode("utf-8", "replace"), m.group(1) == b"<"))
+    return start, end, includes
+
+
+def random_line(rng):
+    """An include-like line, with each piece randomly dropped or mangled."""
+    space = [b"", b" ", b"\t", b"\f", b"\v", b"\r", b"  "]
+    pieces = [
+        rng.choice(space),
+        rng.choice([b"#", b"#", b"", b"##"]),
+        rng.choice(space),
+        rng.choice([b"include", b"include", b"includes", b"inc", b"define"]),
+        rng.choice(space),
+        rng.choice([b"<", b'"', b"", b">"]),
+        rng.choice([b"x.h", b"a/b.h", b"", b"\xff", b"y\rz"]),
+        rng.choice([b">", b'"', b"", b"<"]),
+        rng.choice([b"", b" // c", b" /* c */", b" x", b"\r"]),
+    ]
+    return b"".join(piece for piece in pieces if rng.random() < 0.9)
+
+
+def test_find_include_block_matches_regex_reference():
+    rng = random.Random(0)
+    for _ in range(20000):
+        lines = [rng.choice([random_line(rng), b"", b"int x;", b" \t"]) for _ in range(rng.randint(0, 6))]
+        data = b"\n".join(lines) + rng.choice([b"", b"\n"])
+        found = trim_includes.find_include_block(data)
+        if found is not None:
+            start, end, includes = found
+            found = start, end, [(inc.start, inc.end, inc.text, inc.target, inc.angled) for inc in includes]
+        assert found == reference_include_block(data), data
+
+
+@needs_cc
+def test_ccache_only_wraps_object_compiles(tmp_path):
+    log = tmp_path / "launcher.log"
+    launcher = tmp_path / "ccache"
+    launcher.write_text(f'#!/bin/sh\necho "$@" >> {log}\nexec "$@"\n')
+    launcher.chmod(0o755)
+    source = tmp_path / "probe.c"
+    source.write_text("int x;\n")
+    tc = trim_includes.Toolchain(compiler="cc", includes=(), cflags=(), ccache=str(launcher))
+    assert trim_includes.check_source(source, tc, probe=True)[0]
+    assert not log.exists()
+    tc = dataclasses.replace(tc, syntax_only=False)
+    assert trim_includes.check_source(source, tc, probe=True)[0]
+    assert f"-o {tmp_path / 'probe.o'}" in log.read_text()
+    assert not (tmp_path / "probe.o").exists()